@@ -1,60 +1,217 @@
 import sys
 import os
-from utils import load_inverted_index, load_lexicon, load_internal_id_to_docno, tokenize
+import heapq
 
-def intersect(posting_list1: list[tuple[int, int]], posting_list2: list[tuple[int, int]]) -> list[tuple[int, int]]:
+import numba
+import numpy as np
+
+from utils import load_inverted_index, load_lexicon, load_internal_id_to_docno, tokenize, IndexNotFoundError
+
+# above this long/short length ratio, galloping search beats a full binary search per doc id
+GALLOP_RATIO = 8
+# below this size the numpy searchsorted path wins over the jitted linear merge
+MERGE_MIN_LENGTH = 128
+# terms present in more than this fraction of the corpus intersect as bitvectors
+DENSE_DF_RATIO = 0.01
+
+def bitvector_contains(bitvector: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+    """
+    Vectorized membership test of sorted doc ids against a term's bitvector
+    (one bit per document, packed in uint64 words).
+
+    Returns:
+        A boolean mask, True where the doc id is set in the bitvector.
+    """
+    words = bitvector[doc_ids >> 6]
+    bits = np.uint64(1) << (doc_ids.astype(np.uint64) & np.uint64(63))
+    return (words & bits) != 0
+
+@numba.njit(cache=True)
+def merge_intersect(short_ids: np.ndarray, short_freqs: np.ndarray, long_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Intersect two sorted doc_ids arrays of comparable length with a compiled
+    linear two-pointer merge, O(n + m) instead of n binary searches of O(log m).
+
+    The output arrays are preallocated at the short list's length and sliced to
+    the match count, so the whole kernel runs without Python object allocation.
+    """
+    out_ids = np.empty(len(short_ids), dtype=np.int32)
+    out_freqs = np.empty(len(short_ids), dtype=np.int32)
+    count = 0
+    i = 0
+    j = 0
+    while i < len(short_ids) and j < len(long_ids):
+        short_doc_id = short_ids[i]
+        long_doc_id = long_ids[j]
+        if short_doc_id == long_doc_id:
+            out_ids[count] = short_doc_id
+            out_freqs[count] = short_freqs[i]
+            count += 1
+            i += 1
+            j += 1
+        elif short_doc_id < long_doc_id:
+            i += 1
+        else:
+            j += 1
+    return out_ids[:count], out_freqs[:count]
+
+@numba.njit(cache=True)
+def gallop_intersect(long_ids: np.ndarray, short_ids: np.ndarray, short_freqs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Intersect a short sorted doc_ids array with a much longer one using galloping
+    (exponential then binary) search, O(n log(m/n)) instead of O(n + m).
+
+    For each doc id of the short list we grow a window exponentially from the last
+    match position in the long list, then binary search only inside that window,
+    so most of the long list is never touched.
+
+    Returns:
+        A (doc_ids, freqs) pair with the doc ids present in both lists.
+    """
+    out_ids = np.empty(len(short_ids), dtype=np.int32)
+    out_freqs = np.empty(len(short_ids), dtype=np.int32)
+    count = 0
+    lo = 0
+    long_length = len(long_ids)
+
+    for i in range(len(short_ids)):
+        target = short_ids[i]
+        # gallop: double the step until the window end passes the target
+        step = 1
+        while lo + step < long_length and long_ids[lo + step] < target:
+            step *= 2
+        hi = min(lo + step, long_length - 1)
+
+        # binary search only inside the [lo, hi] window
+        position = lo + np.searchsorted(long_ids[lo:hi + 1], target)
+        if position < long_length and long_ids[position] == target:
+            out_ids[count] = target
+            out_freqs[count] = short_freqs[i]
+            count += 1
+        lo = position
+
+    return out_ids[:count], out_freqs[:count]
+
+def intersect(posting_list1: tuple[np.ndarray, np.ndarray], posting_list2: tuple[np.ndarray, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
     """
-    Intersect two postings lists.
+    Intersect two postings lists stored as (doc_ids, freqs) pairs of sorted numpy arrays.
+
+    Instead of a Python two-pointer merge, we binary search every doc id of the
+    shorter list inside the longer one with np.searchsorted and keep the matches,
+    so the whole intersection runs in C.
 
     Args:
-        postings_list1: The first postings list.
-        postings_list2: The second postings list.
+        posting_list1: The first postings list as (doc_ids, freqs) arrays.
+        posting_list2: The second postings list as (doc_ids, freqs) arrays.
 
     Returns:
-        List of tuples (internal doc id, frequency) that satisfy the intersection.
+        A (doc_ids, freqs) pair with the doc ids present in both lists.
     """
-    result = []
-    index_list_1 = 0
-    index_list_2 = 0
-
-    # we stop when one list exceed 
-    while index_list_1 != len(posting_list1) and index_list_2 != len(posting_list2):
-        frequency_1, doc_id_1 = posting_list1[index_list_1]
-        frequency_2, doc_id_2 = posting_list2[index_list_2]
-
-        if doc_id_1 == doc_id_2: 
-            result.append(posting_list1[index_list_1])
-            index_list_1 += 1
-            index_list_2 += 1
-        # we increment the smaller index with the smallest doc id 
-        elif doc_id_1 < doc_id_2:
-            index_list_1 += 1
-        else: 
-            index_list_2 += 1
-            
-    return result
-
-def intersect_postings_lists(postings_lists: list[list[tuple[int, int]]]) -> list[int]:
+    # always search the shorter list inside the longer one
+    if len(posting_list1[0]) > len(posting_list2[0]):
+        posting_list1, posting_list2 = posting_list2, posting_list1
+    short_ids, short_freqs = posting_list1
+    long_ids, long_freqs = posting_list2
+
+    if len(short_ids) == 0 or len(long_ids) == 0:
+        return short_ids[:0], short_freqs[:0]
+
+    # only doc ids inside the [min, max] range of the longer list can match
+    start = np.searchsorted(short_ids, long_ids[0], side='left')
+    end = np.searchsorted(short_ids, long_ids[-1], side='right')
+    short_ids = short_ids[start:end]
+    short_freqs = short_freqs[start:end]
+
+    # when the sizes are very skewed, galloping search touches far fewer cache lines
+    if len(long_ids) > GALLOP_RATIO * len(short_ids):
+        return gallop_intersect(long_ids, short_ids, short_freqs)
+
+    # comparable sizes and long enough to amortize the call: compiled linear merge
+    if len(short_ids) > MERGE_MIN_LENGTH:
+        return merge_intersect(short_ids, short_freqs, long_ids)
+
+    # after the range cutoff every index is < len(long_ids), so no clipping is needed
+    indexes = np.searchsorted(long_ids, short_ids)
+    mask = long_ids[indexes] == short_ids
+
+    return short_ids[mask], short_freqs[mask]
+
+def intersect_postings_lists(postings_lists: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
     """
     Intersect the postings lists of the terms in the query.
 
+    For three or more lists we do a single k-way synchronized advance instead of
+    pairwise passes: a min-heap of (head doc id, list index) tells us which cursor
+    lags behind, and that cursor skips ahead to the current max doc id with
+    np.searchsorted. A doc id is emitted only when all k cursors agree on it, so
+    every postings list is traversed at most once.
+
     Args:
-        postings_lists: A list of postings lists of the terms in the query.
+        postings_lists: A list of (doc_ids, freqs) postings lists of the terms in the query.
 
     Returns:
-        A list of internal doc ids that satisfy the query.
+        A (doc_ids, freqs) pair with the internal doc ids that satisfy the query.
     """
     if len(postings_lists) == 0:
-        return []
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    if len(postings_lists) == 1:
+        return postings_lists[0]
+    # for two lists the vectorized pairwise intersection is already a single pass
+    if len(postings_lists) == 2:
+        return intersect(postings_lists[0], postings_lists[1])
+
+    ids_arrays = [postings_list[0] for postings_list in postings_lists]
+    # the caller sorts by length, so the freqs of the smallest list drive the output
+    # (same freqs the pairwise reduction used to keep)
+    smallest_freqs = postings_lists[0][1]
 
-    result = postings_lists[0]
-    current_list_index = 1
-    # we stop when we reach the end of the postings lists or the result is empty
-    while current_list_index != len(postings_lists) and len(result) != 0:
-        result = intersect(result, postings_lists[current_list_index])
-        current_list_index += 1
+    k = len(ids_arrays)
+    lengths = [len(ids) for ids in ids_arrays]
+    if min(lengths) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
 
-    return result
+    cursors = [0] * k
+    result_doc_ids = []
+    result_freqs = []
+
+    heap = [(int(ids_arrays[i][0]), i) for i in range(k)]
+    heapq.heapify(heap)
+    # the largest head across the k cursors: every other cursor has to reach it
+    max_doc = max(head for head, _ in heap)
+
+    while True:
+        head, list_index = heapq.heappop(heap)
+
+        if head == max_doc:
+            # the popped head was the minimum, so all k cursors agree: emit
+            result_doc_ids.append(max_doc)
+            result_freqs.append(smallest_freqs[cursors[0]])
+
+            # advance every cursor past the emitted doc id
+            exhausted = False
+            for i in range(k):
+                cursors[i] += 1
+                if cursors[i] == lengths[i]:
+                    exhausted = True
+            if exhausted:
+                break
+            heap = [(int(ids_arrays[i][cursors[i]]), i) for i in range(k)]
+            heapq.heapify(heap)
+            max_doc = max(head for head, _ in heap)
+            continue
+
+        # the lagging cursor skips ahead to max_doc instead of advancing one by one
+        cursor = cursors[list_index]
+        position = cursor + int(np.searchsorted(ids_arrays[list_index][cursor:], max_doc))
+        if position == lengths[list_index]:
+            break
+        cursors[list_index] = position
+        new_head = int(ids_arrays[list_index][position])
+        if new_head > max_doc:
+            max_doc = new_head
+        heapq.heappush(heap, (new_head, list_index))
+
+    return np.array(result_doc_ids, dtype=np.int32), np.array(result_freqs, dtype=np.int32)
 
 def main():
     # make sure the command line inputs are correct
@@ -77,8 +234,8 @@ example:
     queries_file_path = sys.argv[2]
     output_file_path = sys.argv[3]
 
-    # output result
-    result = ""
+    # output result lines, joined once at the end (string += per line is quadratic)
+    result_lines = []
 
     # check if the storage directory exists
     if not os.path.exists(storage_path):
@@ -91,9 +248,14 @@ example:
         sys.exit()
 
     # load the inverted index, lexicon, and internal_id_to_docno
-    inverted_index = load_inverted_index(storage_path)
-    lexicon = load_lexicon(storage_path)
-    internal_id_to_docno = load_internal_id_to_docno(storage_path)
+    try:
+        inverted_index = load_inverted_index(storage_path)
+        lexicon = load_lexicon(storage_path)
+        internal_id_to_docno = load_internal_id_to_docno(storage_path)
+    except IndexNotFoundError as error:
+        print(error)
+        sys.exit()
+    num_docs = len(internal_id_to_docno)
     print("Finished loading the inverted index, lexicon, and internal_id_to_docno.")
 
 
@@ -110,8 +272,7 @@ example:
     for query in queries:
         topic_number, query_text = query
         # tokenize the query
-        tokens = []
-        tokenize(query_text, tokens)
+        tokens = tokenize(query_text)
 
         # find the term ids from the lexicon
         term_ids = []
@@ -119,27 +280,46 @@ example:
             if token in lexicon:
                 term_ids.append(lexicon[token])
         
-        # get the postings list of the terms in the query
-        postings_lists = [inverted_index[str(term_id)] for term_id in term_ids]
+        # sort the term ids by document frequency, read from the index descriptor,
+        # so we start with the smallest list without decoding any postings block first
+        term_ids.sort(key=inverted_index.get_document_frequency)
+
+        # terms present in more than DENSE_DF_RATIO of the corpus are applied as
+        # cached bitvector filters after the sparse lists are intersected, one O(1)
+        # membership probe per surviving candidate instead of a scan of a huge list
+        dense_threshold = num_docs * DENSE_DF_RATIO
+        sparse_term_ids = [term_id for term_id in term_ids if inverted_index.get_document_frequency(term_id) < dense_threshold]
+        dense_term_ids = [term_id for term_id in term_ids if inverted_index.get_document_frequency(term_id) >= dense_threshold]
+        # the smallest list always stays in array form to drive the intersection
+        if len(sparse_term_ids) == 0 and len(dense_term_ids) > 0:
+            sparse_term_ids.append(dense_term_ids.pop(0))
 
-        # sort the postings lists by the length of the list to start with the smallest list and optimize the intersection
-        postings_lists.sort(key=lambda x: len(x))
+        # get the postings list of the sparse terms in the query, already in df order
+        postings_lists = [inverted_index[term_id] for term_id in sparse_term_ids]
 
-        # intersect the postings lists of the terms in the query
-        postings_lists_intersection = intersect_postings_lists(postings_lists)
+        # intersect the postings lists of the sparse terms in the query
+        intersection_doc_ids, _ = intersect_postings_lists(postings_lists)
+
+        # filter the candidates through the bitvector of each dense term
+        for term_id in dense_term_ids:
+            if len(intersection_doc_ids) == 0:
+                break
+            bitvector = inverted_index.get_bitvector(term_id, num_docs)
+            intersection_doc_ids = intersection_doc_ids[bitvector_contains(bitvector, intersection_doc_ids)]
 
         rank = 1
-        # we sort the result by the doc_id to have a consistent output
-        postings_lists_intersection.sort(key=lambda x: x[1])
+        # the doc_ids arrays stay sorted by doc_id, so the output order is already consistent
 
-        docs_number_retrieved = len(postings_lists_intersection)
-        for frequency, doc_id in postings_lists_intersection:
+        docs_number_retrieved = len(intersection_doc_ids)
+        for doc_id in intersection_doc_ids:
             docno = internal_id_to_docno[doc_id]
             score = docs_number_retrieved - rank
             # topicID Q0 docno rank score runTag
-            result += f"{topic_number} Q0 {docno} {rank} {score} fmichelAND\n"
+            result_lines.append(f"{topic_number} Q0 {docno} {rank} {score} fmichelAND\n")
             rank += 1
 
+    result = "".join(result_lines)
+
     # save the output to the output file
     with open(output_file_path, 'w') as file:
         file.write(result)
@@ -2,9 +2,59 @@ import gzip
 import sys
 import os
 import json
-from collections import defaultdict
+import heapq
+import shutil
+from array import array
+from collections import Counter, defaultdict
+from multiprocessing import get_context
 
-from utils import get_text_from_document, extract_document_metadata, format_date, save_document_to_storage, tokenize
+import lmdb
+import numpy as np
+
+from utils import get_text_from_document, extract_document_metadata, format_date, save_document_to_storage, tokenize, encode_postings_block
+
+# number of documents indexed in memory before the postings are flushed as a sorted run
+RUN_BATCH_SIZE = 10000
+
+def parse_document(doc: str) -> tuple[str, str, int, int, int, Counter]:
+    """
+    Parse one raw document into its metadata and token counts. Only reads the
+    document text, so batches of documents can be parsed in parallel worker
+    processes while the parent keeps the sequential lexicon and postings state.
+    """
+    docno, headline, year, month, day = extract_document_metadata(doc)
+    tokens = tokenize(get_text_from_document(doc))
+    return docno, headline, year, month, day, Counter(tokens)
+
+def flush_postings_run(postings_list: defaultdict, runs_path: str, run_counter: int) -> None:
+    """
+    Serialize the in-memory postings as a run of (term_id, doc_id, freq) triples
+    sorted by (term_id, doc_id) and clear them, so peak memory stays at one
+    batch of documents instead of the whole corpus.
+    """
+    total_postings = sum(len(postings) for postings in postings_list.values()) // 2
+    triples = np.empty((total_postings, 3), dtype=np.int32)
+    position = 0
+    for term_id, postings in postings_list.items():
+        # each term's array holds flat [doc_id, freq, doc_id, freq, ...] pairs
+        pairs = np.frombuffer(postings, dtype=np.int32).reshape(-1, 2)
+        count = len(pairs)
+        triples[position:position + count, 0] = term_id
+        triples[position:position + count, 1] = pairs[:, 0]
+        triples[position:position + count, 2] = pairs[:, 1]
+        position += count
+    order = np.lexsort((triples[:, 1], triples[:, 0]))
+    np.save(f"{runs_path}/run_{run_counter}.npy", triples[order])
+    postings_list.clear()
+
+def iterate_run(run_path: str):
+    """
+    Yield the (term_id, doc_id, frequency) triples of a run from its
+    memory-mapped file, without loading the run into memory.
+    """
+    run = np.load(run_path, mmap_mode='r')
+    for record in run:
+        yield int(record[0]), int(record[1]), int(record[2])
 
 def main():
     # make sure the command line inputs are correct
@@ -39,6 +89,21 @@ Example:
     os.makedirs(storage_path)
     print(f"Directory created at {storage_path}")
 
+    # temporary directory for the sorted postings runs, merged and removed at the end
+    runs_path = f"{storage_path}/runs"
+    os.makedirs(runs_path)
+    run_counter = 0
+
+    # pool of worker processes that parse document batches in parallel; forked
+    # before the LMDB environment is opened so the children do not inherit it
+    parse_workers = os.cpu_count() or 1
+    parse_pool = get_context("fork").Pool(parse_workers)
+
+    # one LMDB store for all documents keyed by DOCNO: writing ~150k separate
+    # small files costs a few syscalls each, the store batches them into one file
+    document_store = lmdb.open(f"{storage_path}/docs.lmdb", map_size=5 << 30, writemap=True)
+    document_store_transaction = document_store.begin(write=True)
+
     # initialize variables
     current_doc_lines = []
     internal_id_counter = 0
@@ -47,79 +112,156 @@ Example:
     # the dictionary key is the DOCNO and the value is the internal ID
     docno_to_internal_id = {}
     # we will store the document length in a separate file, with one document length per line where the document length on line 1 goes with document 1, and so forth
-    documents_length = ""
+    # collected as a list of lines and joined once at the end, string += in a loop is quadratic
+    documents_length = []
     # our lexicon consists of a dictionary that maps from a term to its unique integer id.
     lexicon = {}
     # we keep track of the term id counter, for each new term we increment this counter, starting from 0. Used to assign unique integer ids to terms in the lexicon.
     term_id_counter = 0
-    # the postings list is a dictionary where the key is the term id and the value is a list of tuples (frequency, internal_id) where frequency is the number of times the term appears in the document with the internal_id
-    postings_list = defaultdict(list)
+    # the postings list is a dictionary where the key is the term id and the value is a flat
+    # array of [internal_id, frequency, ...] pairs; array('i') stores 8 bytes per posting
+    # instead of a ~56-byte Python tuple per posting
+    postings_list = defaultdict(lambda: array('i'))
+    # the metadata of every document, keyed by docno, written as one shard at the end
+    metadata_all = {}
+    # raw documents of the current batch, parsed together by the worker pool
+    pending_docs = []
+
+    def index_parsed_batch():
+        """
+        Parse the pending documents in the worker pool and fold the results into
+        the sequential index state, then flush the batch as a sorted run.
+        """
+        nonlocal internal_id_counter, term_id_counter, run_counter
+        chunksize = max(1, len(pending_docs) // (parse_workers * 8))
+        parsed = parse_pool.imap(parse_document, pending_docs, chunksize)
+        # imap preserves submission order, so results line up with the raw docs
+        for current_doc, (docno, headline, year, month, day, tokens_counter) in zip(pending_docs, parsed):
+            # store the raw document in the document store under its DOCNO
+            document_store_transaction.put(docno.encode(), current_doc.encode())
+
+            # collect the metadata in a single shard keyed by docno instead of
+            # one small docno.metadata.json file per document
+            metadata_all[docno] = {
+                "id": internal_id_counter,
+                "docno": docno,
+                "headline": headline,
+                "date": format_date(year, month, day)
+            }
+
+            # append the document length to the documents_length lines
+            document_length = sum(tokens_counter.values())
+            documents_length.append(f'{document_length}\n')
+
+            # update the lexicon and the postings list in one pass over the deduped tokens
+            for token, frequency in tokens_counter.items():
+                term_id = lexicon.get(token)
+                if term_id is None:
+                    term_id = term_id_counter
+                    lexicon[token] = term_id
+                    term_id_counter += 1
+                # append the (internal_id, frequency) pair to the postings array of the term
+                postings = postings_list[term_id]
+                postings.append(internal_id_counter)
+                postings.append(frequency)
+
+            # store the docno in the array
+            docnos.append(docno)
+            # store the docno and internal id in the dictionary
+            docno_to_internal_id[docno] = internal_id_counter
+            # increment the internal id counter
+            internal_id_counter += 1
+
+        pending_docs.clear()
+        # flush the postings of the finished batch as a sorted run on disk
+        flush_postings_run(postings_list, runs_path, run_counter)
+        run_counter += 1
 
     # read the latimes file
     with gzip.open(latimes_file_path, 'rt') as file:
         print(f"Reading the latimes file from {latimes_file_path}")
         for line in file:
             if line.startswith("</DOC>"):
-                # end of a document
-                # we store it in the storage directory
-                current_doc = "".join(current_doc_lines)
-                docno, headline, year, month, day = extract_document_metadata(current_doc)
-                # save one file docno.txt with the content of the document at the storagePath/YY/MM/DD/docno.txt
-                save_document_to_storage(current_doc, f"{storage_path}/{year}/{month}/{day}/{docno}.txt")
-
-                # save one file docno.metadata.json with the metadata at the storagePath/YY/MM/DD/docno.metadata.json
-                metadata = {
-                    "id": internal_id_counter,
-                    "docno": docno,
-                    "headline": headline,
-                    "date": format_date(int(year), int(month), int(day))
-                }
-                save_document_to_storage(json.dumps(metadata), f"{storage_path}/{year}/{month}/{day}/{docno}.metadata.json")
-
-                # get text from the document from the following tags: TEXT, HEADLINE, GRAPHIC
-                document_text = get_text_from_document(current_doc)
-                # tokenize the text
-                tokens = []
-                tokenize(document_text, tokens)
-
-                # append the document length to the documents_length string
-                document_length = len(tokens)
-                documents_length += f'{document_length}\n'
-
-                # count the frequency of each token in the document
-                tokens_counter = defaultdict(int)
-                for token in tokens:
-                    tokens_counter[token] += 1
-
-                    # update the lexicon if the term is not already in the lexicon
-                    if token not in lexicon:
-                        lexicon[token] = term_id_counter
-                        term_id_counter += 1
-
-                # update the postings list
-                for token, frequency in tokens_counter.items():
-                    # append (frequency, internal_id) to the postings list of the term
-                    postings_list[lexicon[token]].append((frequency, internal_id_counter))
-                
-                # store the docno in the array
-                docnos.append(docno)
-                # store the docno and internal id in the dictionary
-                docno_to_internal_id[docno] = internal_id_counter
-                
-                # reset the current_doc 
+                # end of a document: queue it for the next parsed batch
+                pending_docs.append("".join(current_doc_lines))
                 current_doc_lines = []
-                # increment the internal id counter
-                internal_id_counter += 1
+                if len(pending_docs) == RUN_BATCH_SIZE:
+                    index_parsed_batch()
                 continue
-        
+
             current_doc_lines.append(line)
 
+    # parse and index the last partial batch
+    if len(pending_docs) > 0:
+        index_parsed_batch()
+    parse_pool.close()
+    parse_pool.join()
+
+    # reassign internal doc ids in chronological order: documents of the same era
+    # co-occur in postings lists, so nearby ids shrink the doc id deltas (better
+    # compression) and the working set of the intersection kernels (better locality).
+    # the date is encoded in the DOCNO as LAMMDDYY-NNNN
+    chronological_order = sorted(
+        range(internal_id_counter),
+        key=lambda doc_id: (docnos[doc_id][6:8], docnos[doc_id][2:4], docnos[doc_id][4:6]),
+    )
+    new_id_of = [0] * internal_id_counter
+    for new_id, old_id in enumerate(chronological_order):
+        new_id_of[old_id] = new_id
+
+    # remap every structure indexed or valued by internal id
+    docnos = [docnos[old_id] for old_id in chronological_order]
+    documents_length = [documents_length[old_id] for old_id in chronological_order]
+    docno_to_internal_id = {docno: new_id for new_id, docno in enumerate(docnos)}
+    for docno in metadata_all:
+        metadata_all[docno]["id"] = docno_to_internal_id[docno]
+
     # save the docnos array and the docno_to_internal_id dictionary to the storage directory
     save_document_to_storage(json.dumps(docnos), f"{storage_path}/internal_id_to_docno.json")
     save_document_to_storage(json.dumps(docno_to_internal_id), f"{storage_path}/docno_to_internal_id.json")
-    save_document_to_storage(documents_length, f"{storage_path}/doc-lengths.txt")
+    save_document_to_storage("".join(documents_length), f"{storage_path}/doc-lengths.txt")
     save_document_to_storage(json.dumps(lexicon), f"{storage_path}/lexicon.json")
-    save_document_to_storage(json.dumps(postings_list), f"{storage_path}/postings-list.json")
+    save_document_to_storage(json.dumps(metadata_all), f"{storage_path}/metadata.json")
+
+    # commit the documents to the store in one transaction
+    document_store_transaction.commit()
+    document_store.close()
+
+    # k-way merge the sorted runs into the final binary postings index:
+    # postings.bin holds per-term variable-byte encoded doc id gaps then freqs,
+    # postings.idx maps term_id -> (offset, length, df) so terms can be decoded on demand.
+    # doc ids are remapped to the chronological ids here, so each term's postings
+    # are re-sorted by their new doc id before the block is encoded
+    run_paths = [f"{runs_path}/run_{n}.npy" for n in range(run_counter)]
+    merged_triples = heapq.merge(*(iterate_run(run_path) for run_path in run_paths))
+
+    postings_index = np.zeros((term_id_counter, 3), dtype=np.int64)
+    offset = 0
+    current_term_id = -1
+    current_postings = []
+    with open(f"{storage_path}/postings.bin", 'wb') as file:
+        for term_id, doc_id, frequency in merged_triples:
+            if term_id != current_term_id:
+                if current_term_id != -1:
+                    current_postings.sort(key=lambda posting: posting[1])
+                    block = bytearray()
+                    encode_postings_block(current_postings, block)
+                    file.write(block)
+                    postings_index[current_term_id] = (offset, len(block), len(current_postings))
+                    offset += len(block)
+                current_term_id = term_id
+                current_postings = []
+            current_postings.append((frequency, new_id_of[doc_id]))
+        if current_term_id != -1:
+            current_postings.sort(key=lambda posting: posting[1])
+            block = bytearray()
+            encode_postings_block(current_postings, block)
+            file.write(block)
+            postings_index[current_term_id] = (offset, len(block), len(current_postings))
+    postings_index.tofile(f"{storage_path}/postings.idx")
+
+    # the merged runs are no longer needed
+    shutil.rmtree(runs_path)
 
     print("Finished reading and storing the documents and metadata from the latimes file.")
 
@@ -1,13 +1,22 @@
 import sys
 import math
 import re
-from collections import defaultdict
 import os
 import json
 import time
 import heapq
 
-from utils import get_file_path_with_docno, get_text_from_document_without_headline, load_inverted_index, load_lexicon, load_internal_id_to_docno, load_doc_lengths, tokenize
+import numpy as np
+
+from utils import get_text_from_document_without_headline, load_inverted_index, load_lexicon, load_internal_id_to_docno, load_doc_lengths, load_metadata, load_document_store, get_document, tokenize, tokenize_cached, bm25_accumulate, IndexNotFoundError
+
+# one match per sentence: everything up to and including the next .!? (or the
+# unterminated tail of the document)
+SENTENCE_PATTERN = re.compile(r'[^.!?]*[.!?]|[^.!?]+$')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
 
 def main():
     # make sure the command line inputs are correct
@@ -33,126 +42,153 @@ example:
 
     print("Loading the inverted index, lexicon...")
 
-    inverted_index = load_inverted_index(storage_path)
-    lexicon = load_lexicon(storage_path)
-    internal_id_to_docno = load_internal_id_to_docno(storage_path)
-    doc_lengths = load_doc_lengths(storage_path)
+    try:
+        inverted_index = load_inverted_index(storage_path)
+        lexicon = load_lexicon(storage_path)
+        internal_id_to_docno = load_internal_id_to_docno(storage_path)
+        doc_lengths = load_doc_lengths(storage_path)
+        # the metadata of every document is loaded once instead of one JSON file per result
+        metadata_all = load_metadata(storage_path)
+        # all documents live in one LMDB store keyed by docno
+        document_store = load_document_store(storage_path)
+    except IndexNotFoundError as error:
+        print(error)
+        sys.exit()
 
     print("Finished loading the inverted index, lexicon, and internal_id_to_docno.")
 
     # compute average document length
     num_docs = len(doc_lengths)
-    avg_doc_length = sum(doc_lengths) / num_docs
+    avg_doc_length = float(doc_lengths.mean())
+
+    # persistent scoring buffers reused across queries: one score slot per document,
+    # plus which documents contain at least one query term (scores can be negative)
+    query_score = np.zeros(num_docs, dtype=np.float32)
+    matched_docs = np.zeros(num_docs, dtype=bool)
 
     while True:
         query = input("Enter your query: ")
         start_time = time.time()
-        query_score = defaultdict(float)
+        # the postings doc id arrays of this query, to reset only the touched entries
+        touched_postings = []
 
-        # tokenize the query
-        query_terms = []
-        tokenize(query, query_terms)
+        # tokenize the query, memoized since interactive queries repeat
+        query_terms = tokenize_cached(query)
 
         # find the term ids from the lexicon
         query_terms_id = []
         for query_term in query_terms:
             if query_term in lexicon:
-                query_terms_id.append(str(lexicon[query_term]))
+                query_terms_id.append(lexicon[query_term])
 
         # BM25 score
         for term_id in query_terms_id:
-            number_of_docs_with_term = len(inverted_index[term_id])
+            # the postings list is stored as two parallel numpy arrays (doc_ids, freqs)
+            posting_doc_ids, posting_freqs = inverted_index[term_id]
+            number_of_docs_with_term = len(posting_doc_ids)
             term_idf = math.log((num_docs - number_of_docs_with_term + 0.5) / (number_of_docs_with_term + 0.5))
 
-            posting_list = inverted_index[term_id]
-            for freq_docid in posting_list:
-                frequency = freq_docid[0]
-                doc_id = freq_docid[1]
-
-                doc_length = doc_lengths[doc_id] 
-                doc_length_normalized = doc_length / avg_doc_length
-                
-                k1 = 1.2
-                b = 0.75
-                K = k1 * (1 - b + b * doc_length_normalized)
-
-                tf = ((k1 + 1) * frequency) / (K + frequency)
-                query_score[doc_id] += tf * term_idf
-        
-        # print the top 10 results with snippet
-        top_10_results = sorted(query_score.items(), key=lambda x: x[1], reverse=True)[:10]
+            # jitted parallel loop: computes the BM25 formula and scatters the
+            # contributions into query_score in one pass over the postings
+            bm25_accumulate(posting_doc_ids, posting_freqs, query_score, doc_lengths, avg_doc_length, term_idf, K1, B)
+            matched_docs[posting_doc_ids] = True
+            touched_postings.append(posting_doc_ids)
+
+        # print the top 10 results with snippet, ignoring documents that matched no term
+        ranked_scores = np.where(matched_docs, query_score, -np.inf)
+        # argpartition selects the 10 best in O(n), then only those 10 get sorted
+        if num_docs > 10:
+            candidate_doc_ids = np.argpartition(-ranked_scores, 10)[:10]
+            top_doc_ids = candidate_doc_ids[np.argsort(-ranked_scores[candidate_doc_ids])]
+        else:
+            top_doc_ids = np.argsort(-ranked_scores)
+        top_10_results = [(int(doc_id), float(query_score[doc_id])) for doc_id in top_doc_ids if matched_docs[doc_id]]
+
+        # zero only the entries this query touched instead of the whole buffers
+        if len(touched_postings) > 0:
+            touched_doc_ids = np.unique(np.concatenate(touched_postings))
+            query_score[touched_doc_ids] = 0.0
+            matched_docs[touched_doc_ids] = False
+
+        # token buffer reused across result documents
+        all_tokens = []
         for rank, (doc_id, score) in enumerate(top_10_results, start=1):
             docno = internal_id_to_docno[doc_id]
 
-            doc_path = get_file_path_with_docno(storage_path, docno) + ".txt"
-            metadata_path = get_file_path_with_docno(storage_path, docno) + ".metadata.json"
-
             snippet = ""
-            with open(doc_path, 'r') as file:
-                doc_text = file.read()
-                doc_content = get_text_from_document_without_headline(doc_text)
-
-                # From Turpin et al. 2007 (Fig 2) DOI: 10.1145/1277741.1277766
-                # "?<=" to keep the punctuation in sentences
-                sentences = re.split(r'(?<=[.!?])', doc_content)
+            doc_text = get_document(document_store, docno)
+            doc_content = get_text_from_document_without_headline(doc_text)
+
+            # From Turpin et al. 2007 (Fig 2) DOI: 10.1145/1277741.1277766
+            # one finditer pass yields sentence spans (punctuation included) and
+            # folds small sentences into the next span, without substring copies
+            sentence_spans = []
+            combined_start = -1
+            for match in SENTENCE_PATTERN.finditer(doc_content):
+                if combined_start == -1:
+                    combined_start = match.start()
                 # we want to combine small sentences with the next one
-                combined_sentences = []
-                sentence_to_combine = ""
-                for sentence in sentences:
-                    sentence_to_combine += sentence
-                    if len(sentence) > 20:
-                        combined_sentences.append(sentence_to_combine)
-                        sentence_to_combine = ""
-                
-                if len(sentence_to_combine) > 0:
-                    combined_sentences.append(sentence_to_combine)
-
-                # max heap to store the best summaries
-                best_summaries = []
-                for index, sentence in enumerate(combined_sentences, start=0):
-                    sentence_tokens = []
-                    tokenize(sentence, sentence_tokens)
-
-                    first_sentences_bonus = 0 
-                    if index == 0:
-                        first_sentences_bonus = 2
-                    elif index == 1:
-                        first_sentences_bonus = 1
-                    
-                    total_occurrences = 0
-                    distinct_query_terms = 0
-                    consecutive_query_term_count = {}
-                    for query_term in query_terms:
-                        query_term_count = 0
-                        for i, token in enumerate(sentence_tokens):
-                            if token == query_term:
-                                query_term_count += 1
-                                # if the previous token is a query term, increment the count
-                                if consecutive_query_term_count.get(i - 1) is not None:
-                                    consecutive_query_term_count[i - 1] += 1
-                                consecutive_query_term_count[i] = 1
-
-                        if query_term_count > 0:
-                            total_occurrences += query_term_count
-                            distinct_query_terms += 1
-                    
-                    max_consecutive_query_term_count = max(consecutive_query_term_count.values()) if consecutive_query_term_count else 0
-
-                    # we keep weights at 1 for now, keep it simple
-                    score = first_sentences_bonus + total_occurrences + distinct_query_terms + max_consecutive_query_term_count
-                    # we normalize the score by the number of tokens in the sentence to avoid favoring long sentences
-                    normalized_score = score / len(sentence_tokens) if len(sentence_tokens) > 0 else 0
-
-                    heapq.heappush(best_summaries, (-normalized_score, sentence))
-                
-                MAX_SNIPPET_LENGTH = 200
-                for best_summary in best_summaries:
-                    snippet += best_summary[1]
-                    if len(snippet) >= MAX_SNIPPET_LENGTH:
-                        break
-                    
-            metadata = json.load(open(metadata_path))
+                if match.end() - match.start() > 20:
+                    sentence_spans.append((combined_start, match.end()))
+                    combined_start = -1
+
+            if combined_start != -1:
+                sentence_spans.append((combined_start, len(doc_content)))
+
+            # tokenize the whole document once into the shared buffer and keep
+            # per-sentence (start, end) token spans instead of per-sentence lists
+            all_tokens.clear()
+            sentence_token_spans = []
+            for sentence_start, sentence_end in sentence_spans:
+                token_start = len(all_tokens)
+                all_tokens.extend(tokenize(doc_content[sentence_start:sentence_end]))
+                sentence_token_spans.append((token_start, len(all_tokens)))
+
+            query_terms_set = set(query_terms)
+
+            # max heap to store the best summaries
+            best_summaries = []
+            for index, (token_start, token_end) in enumerate(sentence_token_spans):
+                first_sentences_bonus = 0
+                if index == 0:
+                    first_sentences_bonus = 2
+                elif index == 1:
+                    first_sentences_bonus = 1
+
+                # one linear scan over the sentence span scores occurrences,
+                # distinct terms and the longest run of consecutive query terms
+                total_occurrences = 0
+                distinct_terms_found = set()
+                consecutive_query_term_count = 0
+                max_consecutive_query_term_count = 0
+                for token in all_tokens[token_start:token_end]:
+                    if token in query_terms_set:
+                        total_occurrences += 1
+                        distinct_terms_found.add(token)
+                        consecutive_query_term_count += 1
+                        if consecutive_query_term_count > max_consecutive_query_term_count:
+                            max_consecutive_query_term_count = consecutive_query_term_count
+                    else:
+                        consecutive_query_term_count = 0
+                distinct_query_terms = len(distinct_terms_found)
+
+                # we keep weights at 1 for now, keep it simple
+                score = first_sentences_bonus + total_occurrences + distinct_query_terms + max_consecutive_query_term_count
+                # we normalize the score by the number of tokens in the sentence to avoid favoring long sentences
+                sentence_token_count = token_end - token_start
+                normalized_score = score / sentence_token_count if sentence_token_count > 0 else 0
+
+                heapq.heappush(best_summaries, (-normalized_score, sentence_spans[index]))
+
+            MAX_SNIPPET_LENGTH = 200
+            for _, (sentence_start, sentence_end) in best_summaries:
+                # only the sentences that make it into the snippet are materialized
+                snippet += doc_content[sentence_start:sentence_end]
+                if len(snippet) >= MAX_SNIPPET_LENGTH:
+                    break
                 
+            metadata = metadata_all[docno]
+
             headline = metadata["headline"] if metadata["headline"] else snippet[:50] + "..."
             print(f"{rank}. {headline} ({metadata['date']})")
             print(f"{snippet} ({docno})\n")
@@ -175,10 +211,7 @@ example:
                 doc_id, score = top_10_results[rank - 1]
                 docno = internal_id_to_docno[doc_id]
 
-                doc_path = get_file_path_with_docno(storage_path, docno) + ".txt"
-                with open(doc_path, 'r') as file:
-                    doc_text = file.read()
-                    print(doc_text)
+                print(get_document(document_store, docno))
             else:
                 print("Invalid input. Please enter 'N', 'Q', or a rank number.")
         